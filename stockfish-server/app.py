@@ -1,47 +1,890 @@
-from flask import Flask, request, jsonify
+from flask import Flask, request
 from flask_cors import CORS  # Import CORS
-from stockfish import Stockfish  # <-- Add this import
+from flask_sock import Sock
+from uci import EngineError, UCIEngine
 import os
 import math
+import hashlib
 import logging
+import msgspec
+import orjson
+import queue
+import re
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from typing import Annotated
+from concurrent.futures import Future, ThreadPoolExecutor
+from contextlib import closing, contextmanager
 
 app = Flask(__name__)
 CORS(app)  # Enable CORS for all routes and origins by default
+sock = Sock(app)  # WebSocket routes
 logging.basicConfig(level=logging.INFO)
 
 # Get Stockfish path from environment variable, default for Docker container
 STOCKFISH_PATH = os.environ.get("STOCKFISH_PATH", "/usr/local/bin/stockfish")
 
-# Initialize Stockfish
-try:
+# Number of engines per process. Each engine searches on a single thread, so
+# concurrent requests are spread across cores instead of queueing on one engine.
+POOL_SIZE = int(
+    os.environ.get("STOCKFISH_POOL_SIZE", max(1, (os.cpu_count() or 2) // 2))
+)
+DEFAULT_DEPTH = 15
+MAX_ANALYSIS_DEPTH = 15  # Maximum depth a client may request
+MAX_BATCH_SIZE = 200  # Maximum number of FENs accepted by /analyze_batch
+MAX_GAME_MOVES = 600  # Maximum number of plies accepted by /analyze_game
+MAX_TOP_MOVES = 10  # Maximum number of lines /top_moves may ask for
+STARTING_FEN = "rnbqkbnr/pppppppp/8/8/8/8/PPPPPPPP/RNBQKBNR w KQkq - 0 1"
+UCI_MOVE_PATTERN = r"^[a-h][1-8][a-h][1-8][qrbn]?$"
+_UCI_MOVE_RE = re.compile(UCI_MOVE_PATTERN)
+DEFAULT_SKILL_LEVEL = 20
+
+# SQLite file holding settings shared by every worker process (gunicorn_conf.py
+# sets one per server); unset, settings are kept in this process only
+SERVER_STATE_PATH = os.environ.get("SERVER_STATE_PATH")
+
+
+class SharedState:
+    """Integer server settings that every worker process must agree on.
+
+    Stored in a small SQLite database so that e.g. a /set_skill handled by one
+    gunicorn worker is seen by all of them. Without a ``path`` (or if it cannot
+    be opened) an in-memory database keeps them per process, which is enough
+    for the single-process development server.
+    """
+
+    def __init__(self, path=None):
+        self._lock = threading.Lock()
+        try:
+            self._db = self._open_db(path or ":memory:")
+        except (OSError, sqlite3.Error) as e:
+            app.logger.warning(
+                f"Could not open server state at {path}, using memory only: {e}"
+            )
+            self._db = self._open_db(":memory:")
+
+    @staticmethod
+    def _open_db(path):
+        if path != ":memory:":
+            os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        db = sqlite3.connect(
+            path, timeout=10, check_same_thread=False, isolation_level=None
+        )
+        if path != ":memory:":
+            db.execute("PRAGMA journal_mode=WAL")
+        db.execute(
+            "CREATE TABLE IF NOT EXISTS settings (name TEXT PRIMARY KEY, value INTEGER)"
+        )
+        return db
+
+    def get(self, name, default):
+        with self._lock:
+            row = self._db.execute(
+                "SELECT value FROM settings WHERE name = ?", (name,)
+            ).fetchone()
+        return default if row is None else row[0]
+
+    def set(self, name, value):
+        with self._lock:
+            self._db.execute(
+                "INSERT INTO settings (name, value) VALUES (?, ?) "
+                "ON CONFLICT (name) DO UPDATE SET value = excluded.value",
+                (name, value),
+            )
+
+    def increment(self, name):
+        """Atomically add one to a setting (missing settings start at 0)."""
+        with self._lock:
+            self._db.execute(
+                "INSERT INTO settings (name, value) VALUES (?, 1) "
+                "ON CONFLICT (name) DO UPDATE SET value = value + 1",
+                (name,),
+            )
+
+
+shared_state = SharedState(SERVER_STATE_PATH)
+
+
+def current_skill_level():
+    """Skill level requested via /set_skill, applied lazily to each engine on checkout."""
+    return shared_state.get("skill_level", DEFAULT_SKILL_LEVEL)
+
+
+def current_game_generation():
+    """Number of /new_game calls so far, across all worker processes."""
+    return shared_state.get("game_generation", 0)
+
+
+# An engine whose generation is older than current_game_generation() clears
+# its hash (ucinewgame) on its next checkout. Otherwise the hash is kept across
+# requests so related positions reuse earlier search work.
+engine_generation = {}  # engine -> game generation it last cleared its hash at
+
+engine_pool = queue.Queue()
+engines = []  # Every engine owned by the pool, checked out or not
+
+# Spreads batch work across the pool, one task per engine
+batch_executor = ThreadPoolExecutor(max_workers=POOL_SIZE)
+
+
+def warm_up(engine):
+    """Run a throwaway depth-1 search to load the NNUE weights and map the hash.
+
+    Done for every new engine, so neither the first request after boot nor the
+    first one after an engine is replaced pays for it.
+    """
+    try:
+        engine.set_position(STARTING_FEN)
+        engine.put("go depth 1")
+        while not engine.read_line().startswith("bestmove"):
+            pass
+    except Exception as e:
+        app.logger.warning(f"Failed to warm up Stockfish: {e}")
+
+
+def create_engine():
     # You might need to adjust parameters based on your system resources
     # Default parameters: depth=15, threads=1, hash=16
-    stockfish = Stockfish(
-        path=STOCKFISH_PATH, depth=15, parameters={"Threads": 2, "Hash": 128}
-    )  # Assign the instance
-    app.logger.info(f"Stockfish initialized successfully from: {STOCKFISH_PATH}")
+    engine = UCIEngine(
+        STOCKFISH_PATH, options={"Threads": 1, "Hash": 128, "MultiPV": 1}
+    )
+    warm_up(engine)
+    engine_generation[engine] = current_game_generation()  # Starts with an empty hash
+    return engine
+
+
+# Initialize Stockfish
+try:
+    for _ in range(POOL_SIZE):
+        engine = create_engine()
+        engines.append(engine)
+        engine_pool.put(engine)
+    app.logger.info(
+        f"Stockfish pool of {POOL_SIZE} engine(s) initialized from: {STOCKFISH_PATH}"
+    )
     app.logger.info(
-        f"Stockfish parameters: {stockfish.get_parameters()}"
+        f"Stockfish engine: {engines[0].name}, options: {engines[0].options}"
     )  # Log parameters
 except Exception as e:
     app.logger.error(f"Failed to initialize Stockfish: {e}")
-    stockfish = None  # Indicate failure
+    engines = []  # Indicate failure
+
+
+@contextmanager
+def checkout_engine():
+    """Borrow an engine from the pool, blocking until one is free.
+
+    Pending /set_skill and /new_game changes are applied before it is handed out.
+    Options the caller changes (e.g. MultiPV) are restored once, on check-in,
+    whichever way the request ends.
+    """
+    engine = engine_pool.get()
+    options = {}
+    try:
+        skill_level = current_skill_level()
+        if engine.options.get("Skill Level", DEFAULT_SKILL_LEVEL) != skill_level:
+            engine.set_option("Skill Level", skill_level)
+        game_generation = current_game_generation()
+        if engine_generation[engine] != game_generation:
+            engine_generation[engine] = game_generation
+            engine.new_game()
+        options = dict(engine.options)
+        yield engine
+    except EngineError:
+        # The engine process died (e.g. on a malformed position); replace it so
+        # the pool keeps its size
+        app.logger.error("Stockfish process crashed, starting a replacement")
+        engines.remove(engine)
+        engine_generation.pop(engine, None)
+        engine.close()
+        engine = create_engine()
+        engines.append(engine)
+        raise
+    finally:
+        try:
+            engine.restore_options(options)
+        finally:
+            engine_pool.put(engine)
+
+
+def fastjson(obj, status=200, etag=None):
+    """Serialize a response body with orjson, which is much faster than jsonify.
+
+    Successful responses given an ``etag`` are marked as cacheable. The ETag
+    is weak: a deeper cached search or a recomputation may return a different
+    but equally valid body for the same request.
+    """
+    response = app.response_class(
+        orjson.dumps(obj), status=status, mimetype="application/json"
+    )
+    if etag is not None and status == 200:
+        response.set_etag(etag, weak=True)
+        response.headers["Cache-Control"] = "public, max-age=86400"
+    return response
+
+
+def make_etag(*parts):
+    """Hash everything that determines an analysis response into an ETag."""
+    key = "|".join(str(part) for part in parts)
+    return hashlib.blake2b(key.encode(), digest_size=12).hexdigest()
+
+
+def not_modified(etag):
+    """Return a 304 response if the client already holds this ETag, else None."""
+    if request.if_none_match.contains_weak(etag):
+        response = app.response_class(status=304)
+        response.set_etag(etag, weak=True)
+        return response
+    return None
+
+
+# Request bodies, decoded and validated in one pass by msgspec
+class AnalyzeRequest(msgspec.Struct):
+    fen: str
+    depth: int | None = None  # Optional depth override
+
+
+class BatchRequest(msgspec.Struct):
+    fens: Annotated[list[str], msgspec.Meta(min_length=1, max_length=MAX_BATCH_SIZE)]
+    depth: int | None = None  # Optional depth override, applied to every FEN
+
+
+class GameRequest(msgspec.Struct):
+    moves: Annotated[
+        list[Annotated[str, msgspec.Meta(pattern=UCI_MOVE_PATTERN)]],
+        msgspec.Meta(max_length=MAX_GAME_MOVES),
+    ]
+    start_fen: str = STARTING_FEN
+    depth: int | None = None  # Optional depth override, applied to every ply
+
+
+class FenRequest(msgspec.Struct):
+    fen: str
+
+
+class MoveRequest(msgspec.Struct):
+    fen: str
+    move: str
+
+
+class TopMovesRequest(msgspec.Struct):
+    fen: str
+    n: Annotated[int, msgspec.Meta(ge=1, le=MAX_TOP_MOVES)] = 3
+
+
+class SkillRequest(msgspec.Struct):
+    level: Annotated[int, msgspec.Meta(ge=0, le=20)]
+
+
+def decode_request(request_type):
+    """Decode and validate the request body; msgspec errors become 400 responses."""
+    return msgspec.json.decode(request.get_data(), type=request_type)
+
+
+@app.errorhandler(msgspec.DecodeError)
+def invalid_request_body(e):
+    # Covers malformed JSON and msgspec.ValidationError (wrong or missing fields)
+    return fastjson({"success": False, "error": f"Invalid request body: {e}"}, 400)
+
+
+# Cheap FEN checks, so positions never need a round trip to the engine. They
+# reject the malformed positions that crash Stockfish instead of searching them.
+_FEN_RE = re.compile(
+    r"^([rnbqkpRNBQKP1-8]+/){7}[rnbqkpRNBQKP1-8]+ [wb] (-|[KQkq]{1,4}) (-|[a-h][36]) \d+ \d+$"
+)
+_KNIGHT_STEPS = ((1, 2), (2, 1), (-1, 2), (-2, 1), (1, -2), (2, -1), (-1, -2), (-2, -1))
+_ROOK_STEPS = ((1, 0), (-1, 0), (0, 1), (0, -1))
+_BISHOP_STEPS = ((1, 1), (1, -1), (-1, 1), (-1, -1))
+# Castling flag -> home squares (row, column) of its king and rook; row 0 is rank 8
+_CASTLING_SQUARES = {
+    "K": ((7, 4), (7, 7)),
+    "Q": ((7, 4), (7, 0)),
+    "k": ((0, 4), (0, 7)),
+    "q": ((0, 4), (0, 0)),
+}
+
+
+def _is_attacked(rows, row, col, by_white):
+    """Return True if the square is attacked by a piece of the given side."""
+
+    def piece_at(r, c):
+        return rows[r][c] if 0 <= r < 8 and 0 <= c < 8 else None
+
+    def own(piece):
+        return piece if by_white else piece.lower()
+
+    pawn_row = row + 1 if by_white else row - 1  # White pawns attack towards rank 8
+    if own("P") in (piece_at(pawn_row, col - 1), piece_at(pawn_row, col + 1)):
+        return True
+    for steps, pieces in (
+        (_KNIGHT_STEPS, (own("N"),)),
+        (_ROOK_STEPS + _BISHOP_STEPS, (own("K"),)),
+    ):
+        if any(piece_at(row + dr, col + dc) in pieces for dr, dc in steps):
+            return True
+    for steps, pieces in (
+        (_ROOK_STEPS, (own("R"), own("Q"))),
+        (_BISHOP_STEPS, (own("B"), own("Q"))),
+    ):
+        for dr, dc in steps:
+            r, c = row + dr, col + dc
+            while piece_at(r, c) == ".":
+                r, c = r + dr, c + dc
+            if piece_at(r, c) in pieces:
+                return True
+    return False
+
+
+def quick_fen_ok(fen):
+    """Return True if the FEN describes a position Stockfish can safely search.
+
+    Besides the syntax this checks for one king per side, no pawns on the
+    first or last rank, castling rights backed by a king and rook on their
+    home squares, and that the side not to move is not in check.
+    """
+    if not isinstance(fen, str) or not _FEN_RE.match(fen):
+        return False
+    board, side, castling = fen.split()[:3]
+    if board.count("K") != 1 or board.count("k") != 1:
+        return False  # Stockfish cannot search a position without both kings
+    rows = [
+        "".join("." * int(c) if c.isdigit() else c for c in rank)
+        for rank in board.split("/")
+    ]
+    if any(len(row) != 8 for row in rows):
+        return False
+    if any(pawn in rows[0] + rows[7] for pawn in "Pp"):
+        return False
+    for flag in castling.replace("-", ""):
+        (king_row, king_col), (rook_row, rook_col) = _CASTLING_SQUARES[flag]
+        king, rook = ("K", "R") if flag.isupper() else ("k", "r")
+        if rows[king_row][king_col] != king or rows[rook_row][rook_col] != rook:
+            return False
+    # The side to move could capture the other king
+    waiting_king = "k" if side == "w" else "K"
+    row = next(i for i, rank in enumerate(rows) if waiting_king in rank)
+    col = rows[row].index(waiting_king)
+    return not _is_attacked(rows, row, col, by_white=side == "w")
+
+
+# Maximum number of positions kept in the in-memory analysis cache
+ANALYSIS_CACHE_SIZE = int(os.environ.get("ANALYSIS_CACHE_SIZE", 50_000))
+# SQLite file backing the in-memory cache across restarts (unset = memory only)
+ANALYSIS_CACHE_PATH = os.environ.get("ANALYSIS_CACHE_PATH")
+# Maximum number of positions kept in that file; least recently used go first
+ANALYSIS_CACHE_DB_ROWS = int(os.environ.get("ANALYSIS_CACHE_DB_ROWS", 1_000_000))
+# Bump when the shape of cached payloads or the table changes to discard old entries
+ANALYSIS_CACHE_SCHEMA = 2
+
+
+def normalize_fen(fen):
+    """Strip the halfmove/fullmove counters so equivalent positions share a key."""
+    return " ".join(fen.split()[:4])
+
+
+class AnalysisCache:
+    """Thread-safe LRU cache of engine results keyed by (kind, normalized FEN).
+
+    Each entry remembers the depth it was searched to, so a lookup is a hit
+    whenever the cached search was at least as deep as the requested one.
+
+    If ``path`` is given, entries are also written through to a SQLite
+    database (WAL mode, safe to share between worker processes) and memory
+    misses fall back to it. The stored ``version`` is compared on open and
+    the database is emptied when it differs, e.g. after a Stockfish upgrade.
+    Rows record when they were last used, and every ``PRUNE_INTERVAL`` writes
+    the table is trimmed back to its ``max_rows`` most recently used rows.
+    """
+
+    PRUNE_INTERVAL = 1000
+
+    def __init__(self, maxsize, path=None, version=None, max_rows=None):
+        self.maxsize = maxsize
+        self.max_rows = max_rows
+        self._writes = 0  # Writes since the table was last pruned
+        self._entries = OrderedDict()
+        self._lock = threading.RLock()
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self._inflight = {}  # (kind, fen, depth) -> Future of a running compute
+        self._db = None
+        self._db_lock = threading.Lock()
+        if path:
+            try:
+                self._db = self._open_db(path, version)
+                self._db_prune()
+                app.logger.info(f"Persistent analysis cache opened at: {path}")
+            except (OSError, sqlite3.Error) as e:
+                app.logger.warning(
+                    f"Could not open analysis cache at {path}, using memory only: {e}"
+                )
+
+    @staticmethod
+    def _open_db(path, version):
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        db = sqlite3.connect(path, timeout=10, check_same_thread=False)
+        db.execute("PRAGMA journal_mode=WAL")
+        db.execute("PRAGMA synchronous=NORMAL")
+        with db:
+            db.execute(
+                "CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT)"
+            )
+            row = db.execute("SELECT value FROM meta WHERE key = 'version'").fetchone()
+            if row is None or row[0] != version:
+                db.execute("DROP TABLE IF EXISTS analysis")
+                db.execute(
+                    "INSERT OR REPLACE INTO meta (key, value) VALUES ('version', ?)",
+                    (version,),
+                )
+            db.execute(
+                "CREATE TABLE IF NOT EXISTS analysis ("
+                "kind TEXT, fen TEXT, depth INTEGER, payload BLOB, used REAL, "
+                "PRIMARY KEY (kind, fen))"
+            )
+            db.execute("CREATE INDEX IF NOT EXISTS analysis_used ON analysis (used)")
+        return db
+
+    def _remember(self, key, depth, payload):
+        # Caller holds self._lock
+        self._entries[key] = (depth, payload)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.maxsize:
+            self._entries.popitem(last=False)
+
+    def get(self, kind, fen, depth):
+        key = (kind, normalize_fen(fen))
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[0] >= depth:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return entry[1]
+        row = self._db_get(key)
+        with self._lock:
+            if row is None or row[0] < depth:
+                self.misses += 1
+                return None
+            payload = orjson.loads(row[1])
+            self._remember(key, row[0], payload)
+            self.hits += 1
+            self.disk_hits += 1
+            return payload
+
+    def put(self, kind, fen, depth, payload):
+        key = (kind, normalize_fen(fen))
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[0] > depth:
+                return  # Keep the deeper result already cached
+            self._remember(key, depth, payload)
+        self._db_put(key, depth, payload)
+
+    def get_or_compute(self, kind, fen, depth, compute):
+        """Return a cached result, or call compute() and cache what it returns.
+
+        Concurrent callers that miss on the same (kind, position, depth) share
+        one compute() call: the first runs it and the others wait for its
+        result instead of searching the same position again. A None result
+        is passed on to the waiters but not cached.
+        """
+        payload = self.get(kind, fen, depth)
+        if payload is not None:
+            return payload
+        key = (kind, normalize_fen(fen), depth)
+        with self._lock:
+            # An owner that finished since get() missed has already cached it
+            entry = self._entries.get(key[:2])
+            if entry is not None and entry[0] >= depth:
+                self._entries.move_to_end(key[:2])
+                return entry[1]
+            future = self._inflight.get(key)
+            owner = future is None
+            if owner:
+                future = self._inflight[key] = Future()
+        if not owner:
+            return future.result()
+        try:
+            payload = compute()
+            if payload is not None:
+                self.put(kind, fen, depth, payload)
+            future.set_result(payload)
+            return payload
+        except BaseException as e:
+            future.set_exception(e)
+            raise
+        finally:
+            with self._lock:
+                del self._inflight[key]
+
+    def _db_get(self, key):
+        if self._db is None:
+            return None
+        try:
+            with self._db_lock, self._db:
+                row = self._db.execute(
+                    "SELECT depth, payload FROM analysis WHERE kind = ? AND fen = ?",
+                    key,
+                ).fetchone()
+                if row is not None:
+                    self._db.execute(
+                        "UPDATE analysis SET used = ? WHERE kind = ? AND fen = ?",
+                        (time.time(), *key),
+                    )
+                return row
+        except sqlite3.Error as e:
+            app.logger.warning(f"Analysis cache read failed: {e}")
+            return None
+
+    def _db_put(self, key, depth, payload):
+        if self._db is None:
+            return
+        try:
+            with self._db_lock, self._db:
+                self._db.execute(
+                    "INSERT INTO analysis (kind, fen, depth, payload, used) "
+                    "VALUES (?, ?, ?, ?, ?) "
+                    "ON CONFLICT (kind, fen) DO UPDATE SET "
+                    "depth = excluded.depth, payload = excluded.payload, "
+                    "used = excluded.used "
+                    "WHERE excluded.depth >= analysis.depth",
+                    (*key, depth, orjson.dumps(payload), time.time()),
+                )
+                self._writes += 1
+                prune = self._writes >= self.PRUNE_INTERVAL
+        except sqlite3.Error as e:
+            app.logger.warning(f"Analysis cache write failed: {e}")
+            return
+        if prune:
+            self._db_prune()
+
+    def _db_prune(self):
+        """Delete all but the ``max_rows`` most recently used rows."""
+        if self._db is None or self.max_rows is None:
+            return
+        try:
+            with self._db_lock, self._db:
+                self._writes = 0
+                self._db.execute(
+                    "DELETE FROM analysis WHERE rowid IN (SELECT rowid FROM analysis "
+                    "ORDER BY used DESC LIMIT -1 OFFSET ?)",
+                    (self.max_rows,),
+                )
+        except sqlite3.Error as e:
+            app.logger.warning(f"Analysis cache prune failed: {e}")
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "size": len(self._entries),
+                "maxsize": self.maxsize,
+                "persistent": self._db is not None,
+                "hits": self.hits,
+                "disk_hits": self.disk_hits,
+                "misses": self.misses,
+                "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0,
+            }
+
+
+analysis_cache = AnalysisCache(
+    ANALYSIS_CACHE_SIZE,
+    path=ANALYSIS_CACHE_PATH if engines else None,
+    version=(f"{ANALYSIS_CACHE_SCHEMA}:{engines[0].name}" if engines else None),
+    max_rows=ANALYSIS_CACHE_DB_ROWS,
+)
+
+
+# Win probability for every clamped centipawn value in [-2000, 2000]
+_SIGMOID_LUT = [1 / (1 + math.exp(-0.004 * cp)) for cp in range(-2000, 2001)]
 
 
 def cp_to_win_prob(cp):
     """Convert centipawn evaluation to win probability (simplified)."""
-    # Avoid division by zero or large exponents
+    # Clamp between -20 and +20 pawns and look the value up in the precomputed table
+    clamped_cp = 0 if cp is None else max(-2000, min(2000, int(cp)))
+    return _SIGMOID_LUT[clamped_cp + 2000]
+
+
+def legal_moves(engine, fen, moves=()):
+    """Return the legal moves (UCI notation) in a position, using ``go perft 1``."""
+    engine.set_position(fen, moves)
+    engine.put("go perft 1")
+    legal = []
+    while True:
+        line = engine.read_line()
+        if line.startswith("Nodes searched"):
+            return legal
+        move, _, count = line.partition(":")
+        if count and _UCI_MOVE_RE.match(move):
+            legal.append(move)
+
+
+def search_updates(engine, fen, depth, moves=(), searchmoves=()):
+    """Run a single ``go depth`` search, yielding progress as the engine reports it.
+
+    Yields a dict (depth, multipv, evaluation, pv) for every ``info`` line
+    carrying a score, then a final dict with ``bestmove`` and the evaluation
+    and PV of the principal line. Evaluations are reported from White's point
+    of view. The engine's hash is kept from earlier positions.
+    If the caller stops iterating early, the search is stopped and its output
+    drained so the engine can safely go back to the pool.
+
+    ``moves`` (UCI notation) are played from ``fen`` by the engine itself, via
+    ``position fen ... moves ...``, and the resulting position is searched.
+    ``searchmoves`` restricts the search to those root moves.
+    """
+    engine.set_position(fen, moves)
+    white_to_move = (fen.split()[1] == "w") == (len(moves) % 2 == 0)
+    compare = 1 if white_to_move else -1
+    go = f"go depth {depth}"
+    if searchmoves:
+        go += f" searchmoves {' '.join(searchmoves)}"
+    engine.put(go)
+    finished = False
+    evaluation = {}
+    pv = []
     try:
-        # Clamp cp value to prevent extreme results from exp
-        clamped_cp = max(-2000, min(2000, cp))  # Clamp between -20 and +20 pawns
-        return 1 / (1 + math.exp(-0.004 * clamped_cp))
-    except OverflowError:
-        return 1.0 if cp > 0 else 0.0  # Return 100% or 0% if overflow occurs
+        while True:
+            parts = engine.read_line().split()
+            if not parts:
+                continue
+            if parts[0] == "info" and "score" in parts:
+                i = parts.index("score")
+                line_evaluation = {
+                    "type": parts[i + 1],
+                    "value": int(parts[i + 2]) * compare,
+                }
+                line_pv = parts[parts.index("pv") + 1 :] if "pv" in parts else []
+                multipv = (
+                    int(parts[parts.index("multipv") + 1]) if "multipv" in parts else 1
+                )
+                if multipv == 1:
+                    evaluation = line_evaluation
+                    pv = line_pv or pv
+                yield {
+                    "depth": int(parts[parts.index("depth") + 1]),
+                    "multipv": multipv,
+                    "evaluation": line_evaluation,
+                    "pv": line_pv,
+                }
+            elif parts[0] == "bestmove":
+                finished = True
+                best_move = None if parts[1] == "(none)" else parts[1]
+                yield {"bestmove": best_move, "evaluation": evaluation, "pv": pv}
+                return
+    finally:
+        if not finished:
+            engine.put("stop")
+            while engine.read_line().split()[:1] != ["bestmove"]:
+                pass
+
+
+def analyze_once(engine, fen, depth, moves=()):
+    """Search a position once and return its best move, evaluation and PV.
+
+    Issues a single ``go depth`` and reads the evaluation and best move from
+    the same search.
+    """
+    for update in search_updates(engine, fen, depth, moves):
+        pass
+    return update  # The final bestmove update
+
+
+def top_moves(engine, fen, n, depth, searchmoves=()):
+    """Return the n best moves as [{"Move", "Centipawn", "Mate"}], using MultiPV.
+
+    Scores are from White's point of view; an empty list means no legal moves.
+    MultiPV is reset by checkout_engine() when the engine is returned.
+    """
+    engine.set_option("MultiPV", n)
+    lines = {}
+    current_depth = 0
+    for update in search_updates(engine, fen, depth, searchmoves=searchmoves):
+        if "bestmove" in update:
+            if update["bestmove"] is None:
+                return []
+            continue
+        if update["multipv"] > n:
+            continue  # Below Skill Level 20, Stockfish searches at least 4 lines
+        if update["depth"] != current_depth:
+            # Only report lines from the deepest iteration
+            current_depth, lines = update["depth"], {}
+        lines[update["multipv"]] = update
+    return [
+        {
+            "Move": line["pv"][0],
+            "Centipawn": (
+                line["evaluation"]["value"]
+                if line["evaluation"]["type"] == "cp"
+                else None
+            ),
+            "Mate": (
+                line["evaluation"]["value"]
+                if line["evaluation"]["type"] == "mate"
+                else None
+            ),
+        }
+        for _, line in sorted(lines.items())
+        if line["pv"]
+    ]
+
+
+def _move_score(move, white_to_move):
+    """Sort key for a top_moves() entry, higher is better for the side to move."""
+    sign = 1 if white_to_move else -1
+    if move["Mate"] is not None:
+        mate = move["Mate"] * sign
+        # Faster mates first, slower mates against us last
+        return 100000 - mate if mate > 0 else -100000 - mate
+    return move["Centipawn"] * sign
+
+
+def parallel_top_moves(fen, n, depth):
+    """top_moves() with the legal root moves split across the engine pool.
+
+    Each engine searches its share of the root moves (``go searchmoves``) with
+    MultiPV capped at n, and the best n lines of all engines are merged. With a
+    single engine this is a plain MultiPV search.
+    """
+    if POOL_SIZE < 2:
+        with checkout_engine() as engine:
+            return top_moves(engine, fen, n, depth)
+    with checkout_engine() as engine:
+        legal = legal_moves(engine, fen)
+    if not legal:
+        return []
+    groups = [legal[i::POOL_SIZE] for i in range(min(POOL_SIZE, len(legal)))]
+
+    def search_group(group):
+        with checkout_engine() as engine:
+            return top_moves(engine, fen, min(n, len(group)), depth, group)
+
+    moves = [
+        move for result in batch_executor.map(search_group, groups) for move in result
+    ]
+    white_to_move = fen.split()[1] == "w"
+    moves.sort(key=lambda move: _move_score(move, white_to_move), reverse=True)
+    return moves[:n]
+
+
+def cached_analysis(fen, depth):
+    """Return analyze_once() results for a FEN, or None if the FEN is invalid.
+
+    Shared by /analyze, /move, /evaluation and /win_chance so they all reuse
+    the same cache entries.
+    """
+    # Checked before the cache, whose normalized keys would accept malformed FENs
+    if not quick_fen_ok(fen):
+        return None
+    kind = f"analysis/{current_skill_level()}"  # Bestmove depends on the skill level
+
+    def search():
+        with checkout_engine() as engine:
+            return analyze_once(engine, fen, depth)
+
+    return analysis_cache.get_or_compute(kind, fen, depth, search)
+
+
+def analyze_fens(fens, depth):
+    """Analyze a list of FENs on one engine and return /analyze-style results.
+
+    Cache hits and invalid FENs are resolved first; an engine is only checked
+    out if positions remain to be searched. Its hash is not cleared between
+    positions, so consecutive positions from the same game benefit from
+    earlier searches.
+    """
+    kind = f"analysis/{current_skill_level()}"
+    # Validated before the cache, as in cached_analysis()
+    valid = [quick_fen_ok(fen) for fen in fens]
+    analyses = [
+        analysis_cache.get(kind, fen, depth) if ok else None
+        for fen, ok in zip(fens, valid)
+    ]
+    misses = [
+        i
+        for i, (ok, analysis) in enumerate(zip(valid, analyses))
+        if ok and analysis is None
+    ]
+    if misses:
+        with checkout_engine() as engine:
+            for i in misses:
+                analyses[i] = analyze_once(engine, fens[i], depth)
+                analysis_cache.put(kind, fens[i], depth, analyses[i])
+    return [analysis_result(fen, analysis)[0] for fen, analysis in zip(fens, analyses)]
+
+
+def resolve_depth(depth):
+    """Return the requested search depth, or DEFAULT_DEPTH if it is missing or out of range."""
+    if depth is None:
+        return DEFAULT_DEPTH
+    if not 1 <= depth <= MAX_ANALYSIS_DEPTH:
+        app.logger.warning(
+            f"Invalid depth requested ({depth}), must be between 1 and {MAX_ANALYSIS_DEPTH}. Using default: {DEFAULT_DEPTH}"
+        )
+        return DEFAULT_DEPTH
+    app.logger.info(f"Using requested depth: {depth}")
+    return depth
+
+
+def analysis_result(fen, analysis):
+    """Build the /analyze response body for a FEN from analyze_once() output.
+
+    ``analysis`` is None when the FEN was rejected as invalid. Returns a
+    (result_data, status_code) tuple.
+    """
+    if analysis is None:
+        app.logger.warning(f"Invalid FEN string provided: {fen}")
+        return {
+            "fen": fen,
+            "success": False,
+            "error": "Invalid FEN string provided",
+        }, 400  # Return 400 for bad request
+
+    evaluation = analysis["evaluation"]
+    best_move = analysis["bestmove"]
+
+    if not best_move:
+        app.logger.warning(f"Stockfish returned no best move for FEN: {fen}")
+        return {
+            "fen": fen,
+            "success": False,
+            "error": "Stockfish could not determine a best move",
+        }, 500  # Internal server issue if SF can't find a move
+
+    result_data = {
+        "fen": fen,
+        "success": True,
+        "evaluation": None,
+        "mate": None,
+        "bestmove": best_move,
+        "continuation": " ".join(analysis["pv"][1:]),
+    }
+
+    if evaluation["type"] == "cp":
+        result_data["evaluation"] = round(evaluation["value"] / 100.0, 2)
+    elif evaluation["type"] == "mate":
+        result_data["mate"] = evaluation["value"]
+        # Assign a large number for mate evaluation for consistency client-side
+        result_data["evaluation"] = 999 if evaluation["value"] > 0 else -999
+    else:
+        app.logger.error(
+            f"Unknown evaluation type '{evaluation.get('type')}' for FEN: {fen}"
+        )
+        return {
+            "fen": fen,
+            "success": False,
+            "error": f"Unknown evaluation type: {evaluation.get('type')}",
+        }, 500  # Internal server error
+
+    return result_data, 200
 
 
 @app.route("/")
 def index():
-    if stockfish:
+    if engines:
         return f"Stockfish UCI server running. Engine: {STOCKFISH_PATH}"
     else:
         return "Stockfish UCI server failed to initialize engine.", 500
@@ -51,141 +894,133 @@ def index():
     "/analyze", methods=["POST", "OPTIONS"]
 )  # Add OPTIONS method for CORS preflight
 def analyze_position():
-    if not stockfish:
-        return (
-            jsonify({"success": False, "error": "Stockfish engine not initialized"}),
+    if not engines:
+        return fastjson(
+            {"success": False, "error": "Stockfish engine not initialized"}, 500
+        )
+
+    req = decode_request(AnalyzeRequest)
+    fen = req.fen  # Expect a single FEN string
+    valid_depth = resolve_depth(req.depth)
+    if not quick_fen_ok(fen):
+        # Rejected before the ETag, so "If-None-Match: *" cannot 304 a bad FEN
+        return fastjson(*analysis_result(fen, None))
+
+    etag = make_etag(
+        request.path, normalize_fen(fen), valid_depth, current_skill_level()
+    )
+    cached_response = not_modified(etag)
+    if cached_response:
+        return cached_response
+
+    try:
+        analysis = cached_analysis(fen, valid_depth)
+        result_data, status = analysis_result(fen, analysis)
+        if status == 200:
+            app.logger.info(
+                f"Analyzed FEN: {fen}, Depth: {valid_depth}, Eval: {analysis['evaluation']}, Best Move: {analysis['bestmove']}"
+            )
+        return fastjson(result_data, status, etag)
+
+    except Exception as e:
+        app.logger.error(f"Error during analysis for FEN {fen}: {e}", exc_info=True)
+        return fastjson(
+            {
+                "fen": fen,
+                "success": False,
+                "error": f"Internal server error during analysis: {e}",
+            },
             500,
         )
 
-    data = request.get_json()
-    fen = data.get("fen")  # Expect a single FEN string
-    depth = data.get("depth")  # Optional depth override
-
-    # Check if 'fen' is provided and is a string
-    if not fen or not isinstance(fen, str):
-        return (
-            jsonify(
-                {
-                    "success": False,
-                    "error": "FEN string ('fen') not provided or not a string",
-                }
-            ),
-            400,
+
+@app.route("/analyze_batch", methods=["POST", "OPTIONS"])
+def analyze_batch():
+    if not engines:
+        return fastjson(
+            {"success": False, "error": "Stockfish engine not initialized"}, 500
         )
 
-    original_depth = stockfish.depth  # Store original depth
+    req = decode_request(BatchRequest)
+    fens = req.fens  # Expect a list of FEN strings, e.g. one per ply
+    valid_depth = resolve_depth(req.depth)
 
-    # Set depth if provided and valid
-    valid_depth = original_depth  # Default to original
-    if depth is not None:
-        try:
-            requested_depth = int(depth)
-            # Keep MAX_ANALYSIS_DEPTH limit if desired, e.g., 15 or 20
-            MAX_ANALYSIS_DEPTH = 15  # Define a reasonable max depth
-            if 1 <= requested_depth <= MAX_ANALYSIS_DEPTH:
-                valid_depth = requested_depth
-                app.logger.info(f"Using requested depth: {valid_depth}")
-            else:
-                app.logger.warning(
-                    f"Invalid depth requested ({depth}), must be between 1 and {MAX_ANALYSIS_DEPTH}. Using default: {original_depth}"
-                )
-                # valid_depth remains original_depth
-        except ValueError:
-            app.logger.warning(
-                f"Invalid depth format ({depth}), using default: {original_depth}"
-            )
-            # valid_depth remains original_depth
+    # Split the list into contiguous chunks, one per engine, so consecutive
+    # positions of a game still share an engine and its transposition table
+    chunk_size = -(-len(fens) // min(POOL_SIZE, len(fens)))
+    chunks = [fens[i : i + chunk_size] for i in range(0, len(fens), chunk_size)]
+
+    try:
+        results = []
+        for chunk_results in batch_executor.map(
+            lambda chunk: analyze_fens(chunk, valid_depth), chunks
+        ):
+            results.extend(chunk_results)
+        app.logger.info(f"Analyzed batch of {len(fens)} FENs, Depth: {valid_depth}")
+        return fastjson({"success": True, "results": results})
 
-    # Set the depth for this specific analysis
-    stockfish.set_depth(valid_depth)
+    except Exception as e:
+        app.logger.error(f"Error during batch analysis: {e}", exc_info=True)
+        return fastjson(
+            {
+                "success": False,
+                "error": f"Internal server error during analysis: {e}",
+            },
+            500,
+        )
+
+
+# Analyzes every position of a game given as a start position plus UCI moves.
+# One engine plays the moves itself ("position fen ... moves ...") and keeps
+# its hash across plies, so each search builds on the previous one.
+@app.route("/analyze_game", methods=["POST", "OPTIONS"])
+def analyze_game():
+    if not engines:
+        return fastjson(
+            {"success": False, "error": "Stockfish engine not initialized"}, 500
+        )
+
+    req = decode_request(GameRequest)
+    start_fen, moves = req.start_fen, req.moves
+    if not quick_fen_ok(start_fen):
+        return fastjson({"success": False, "error": "Invalid FEN string provided"}, 400)
+    valid_depth = resolve_depth(req.depth)
 
     try:
-        if not stockfish.is_fen_valid(fen):
-            app.logger.warning(f"Invalid FEN string provided: {fen}")
-            # Reset depth before returning error
-            stockfish.set_depth(original_depth)
-            return (
-                jsonify(
-                    {
-                        "fen": fen,
-                        "success": False,
-                        "error": "Invalid FEN string provided",
-                    }
-                ),
-                400,
-            )  # Return 400 for bad request
-
-        stockfish.set_fen_position(fen)
-        current_eval_depth = stockfish.depth  # Log the depth being used
-        evaluation = stockfish.get_evaluation()
-        best_move = stockfish.get_best_move()  # Get best move with current depth
-
-        if not best_move:
-            app.logger.warning(f"Stockfish returned no best move for FEN: {fen}")
-            # Reset depth before returning error
-            stockfish.set_depth(original_depth)
-            return (
-                jsonify(
-                    {
-                        "fen": fen,
-                        "success": False,
-                        "error": "Stockfish could not determine a best move",
-                    }
-                ),
-                500,
-            )  # Internal server issue if SF can't find a move
-
-        result_data = {
-            "fen": fen,
-            "success": True,
-            "evaluation": None,
-            "mate": None,
-            "bestmove": best_move,
-            "continuation": "",  # Placeholder
-        }
+        results = []
+        with checkout_engine() as engine:
+            # Stockfish silently stops at an illegal move, so check them first
+            for ply, move in enumerate(moves):
+                if move not in legal_moves(engine, start_fen, moves[:ply]):
+                    return fastjson(
+                        {
+                            "success": False,
+                            "error": f"Illegal move {move} at ply {ply + 1}",
+                        },
+                        400,
+                    )
 
-        if evaluation["type"] == "cp":
-            result_data["evaluation"] = round(evaluation["value"] / 100.0, 2)
-        elif evaluation["type"] == "mate":
-            result_data["mate"] = evaluation["value"]
-            # Assign a large number for mate evaluation for consistency client-side
-            result_data["evaluation"] = 999 if evaluation["value"] > 0 else -999
-        else:
-            app.logger.error(
-                f"Unknown evaluation type '{evaluation.get('type')}' for FEN: {fen}"
-            )
-            # Reset depth before returning error
-            stockfish.set_depth(original_depth)
-            return (
-                jsonify(
-                    {
-                        "fen": fen,
-                        "success": False,
-                        "error": f"Unknown evaluation type: {evaluation.get('type')}",
-                    }
-                ),
-                500,
-            )  # Internal server error
-
-        # Reset depth to original default after successful analysis
-        stockfish.set_depth(original_depth)
+            for ply in range(len(moves) + 1):
+                played = moves[:ply]
+                analysis = analyze_once(engine, start_fen, valid_depth, played)
+                position = f"{start_fen} moves {' '.join(played)}"
+                result, _ = analysis_result(position, analysis)
+                del result["fen"]
+                results.append(
+                    {"ply": ply, "move": moves[ply - 1] if ply else None, **result}
+                )
         app.logger.info(
-            f"Analyzed FEN: {fen}, Depth: {current_eval_depth}, Eval: {evaluation}, Best Move: {best_move}"
+            f"Analyzed game of {len(moves)} moves from FEN: {start_fen}, Depth: {valid_depth}"
         )
-        return jsonify(result_data)  # Return the single result object
+        return fastjson({"success": True, "start_fen": start_fen, "results": results})
 
     except Exception as e:
-        app.logger.error(f"Error during analysis for FEN {fen}: {e}", exc_info=True)
-        # Reset depth in case of exception
-        stockfish.set_depth(original_depth)
-        return (
-            jsonify(
-                {
-                    "fen": fen,
-                    "success": False,
-                    "error": f"Internal server error during analysis: {e}",
-                }
-            ),
+        app.logger.error(f"Error during game analysis: {e}", exc_info=True)
+        return fastjson(
+            {
+                "success": False,
+                "error": f"Internal server error during analysis: {e}",
+            },
             500,
         )
 
@@ -195,118 +1030,175 @@ def analyze_position():
 
 @app.route("/move", methods=["POST", "OPTIONS"])  # Add OPTIONS
 def get_move():
-    if not stockfish:
-        return jsonify({"error": "Stockfish engine not initialized"}), 500
-    data = request.get_json()
-    fen = data.get("fen")
-    if not fen:
-        return jsonify({"error": "FEN not provided"}), 400
+    if not engines:
+        return fastjson({"error": "Stockfish engine not initialized"}, 500)
+    fen = decode_request(FenRequest).fen
+    if not quick_fen_ok(fen):
+        return fastjson({"error": "Invalid FEN"}, 400)
+    etag = make_etag(
+        request.path, normalize_fen(fen), DEFAULT_DEPTH, current_skill_level()
+    )
+    cached_response = not_modified(etag)
+    if cached_response:
+        return cached_response
     try:
-        if not stockfish.is_fen_valid(fen):
-            return jsonify({"error": "Invalid FEN"}), 400
-        stockfish.set_fen_position(fen)
-        return jsonify({"best_move": stockfish.get_best_move()})
+        analysis = cached_analysis(fen, DEFAULT_DEPTH)
+        return fastjson({"best_move": analysis["bestmove"]}, etag=etag)
     except Exception as e:
-        return jsonify({"error": str(e)}), 500
+        return fastjson({"error": str(e)}, 500)
 
 
 @app.route("/evaluation", methods=["POST", "OPTIONS"])  # Add OPTIONS
 def get_eval():
-    if not stockfish:
-        return jsonify({"error": "Stockfish engine not initialized"}), 500
-    data = request.get_json()
-    fen = data.get("fen")
-    if not fen:
-        return jsonify({"error": "FEN not provided"}), 400
+    if not engines:
+        return fastjson({"error": "Stockfish engine not initialized"}, 500)
+    fen = decode_request(FenRequest).fen
+    if not quick_fen_ok(fen):
+        return fastjson({"error": "Invalid FEN"}, 400)
+    etag = make_etag(
+        request.path, normalize_fen(fen), DEFAULT_DEPTH, current_skill_level()
+    )
+    cached_response = not_modified(etag)
+    if cached_response:
+        return cached_response
     try:
-        if not stockfish.is_fen_valid(fen):
-            return jsonify({"error": "Invalid FEN"}), 400
-        stockfish.set_fen_position(fen)
-        return jsonify(stockfish.get_evaluation())
+        analysis = cached_analysis(fen, DEFAULT_DEPTH)
+        return fastjson(analysis["evaluation"], etag=etag)
     except Exception as e:
-        return jsonify({"error": str(e)}), 500
+        return fastjson({"error": str(e)}, 500)
 
 
 @app.route("/win_chance", methods=["POST", "OPTIONS"])  # Add OPTIONS
 def get_win_chance():
-    if not stockfish:
-        return jsonify({"error": "Stockfish engine not initialized"}), 500
-    data = request.get_json()
-    fen = data.get("fen")
-    if not fen:
-        return jsonify({"error": "FEN not provided"}), 400
+    if not engines:
+        return fastjson({"error": "Stockfish engine not initialized"}, 500)
+    fen = decode_request(FenRequest).fen
+    if not quick_fen_ok(fen):
+        return fastjson({"error": "Invalid FEN"}, 400)
+    etag = make_etag(
+        request.path, normalize_fen(fen), DEFAULT_DEPTH, current_skill_level()
+    )
+    cached_response = not_modified(etag)
+    if cached_response:
+        return cached_response
     try:
-        if not stockfish.is_fen_valid(fen):
-            return jsonify({"error": "Invalid FEN"}), 400
-        stockfish.set_fen_position(fen)
-        eval_data = stockfish.get_evaluation()
+        analysis = cached_analysis(fen, DEFAULT_DEPTH)
+        eval_data = analysis["evaluation"]
         if eval_data["type"] == "cp":
             prob = cp_to_win_prob(eval_data["value"])
-            return jsonify({"white_win_chance": round(prob, 4)})
+            return fastjson({"white_win_chance": round(prob, 4)}, etag=etag)
         elif eval_data["type"] == "mate":
-            return jsonify({"white_win_chance": 1.0 if eval_data["value"] > 0 else 0.0})
+            return fastjson(
+                {"white_win_chance": 1.0 if eval_data["value"] > 0 else 0.0},
+                etag=etag,
+            )
         else:
-            return jsonify({"error": "Unknown evaluation type"}), 400
+            return fastjson({"error": "Unknown evaluation type"}, 400)
     except Exception as e:
-        return jsonify({"error": str(e)}), 500
+        return fastjson({"error": str(e)}, 500)
 
 
 @app.route("/is_move_legal", methods=["POST", "OPTIONS"])  # Add OPTIONS
 def check_move_legal():
-    if not stockfish:
-        return jsonify({"error": "Stockfish engine not initialized"}), 500
-    data = request.get_json()
-    fen = data.get("fen")
-    move = data.get("move")
-    if not fen or not move:
-        return jsonify({"error": "FEN or move not provided"}), 400
+    if not engines:
+        return fastjson({"error": "Stockfish engine not initialized"}, 500)
+    req = decode_request(MoveRequest)
+    fen, move = req.fen, req.move
     try:
-        if not stockfish.is_fen_valid(fen):
-            return jsonify({"error": "Invalid FEN"}), 400
-        stockfish.set_fen_position(fen)
-        return jsonify({"is_legal": stockfish.is_move_correct(move)})
+        if not quick_fen_ok(fen):
+            return fastjson({"error": "Invalid FEN"}, 400)
+        with checkout_engine() as engine:
+            return fastjson({"is_legal": move in legal_moves(engine, fen)})
     except Exception as e:
-        return jsonify({"error": str(e)}), 500
+        return fastjson({"error": str(e)}, 500)
 
 
 @app.route("/top_moves", methods=["POST", "OPTIONS"])  # Add OPTIONS
 def get_top_moves():
-    if not stockfish:
-        return jsonify({"error": "Stockfish engine not initialized"}), 500
-    data = request.get_json()
-    fen = data.get("fen")
-    n = int(data.get("n", 3))
-    if not fen:
-        return jsonify({"error": "FEN not provided"}), 400
+    if not engines:
+        return fastjson({"error": "Stockfish engine not initialized"}, 500)
+    req = decode_request(TopMovesRequest)
+    fen, n = req.fen, req.n
+    depth = DEFAULT_DEPTH
+    if not quick_fen_ok(fen):
+        return fastjson({"error": "Invalid FEN"}, 400)
+    skill_level = current_skill_level()
+    etag = make_etag(request.path, normalize_fen(fen), depth, n, skill_level)
+    cached_response = not_modified(etag)
+    if cached_response:
+        return cached_response
+
+    def search():
+        return {"top_moves": parallel_top_moves(fen, n, depth)}
+
     try:
-        if not stockfish.is_fen_valid(fen):
-            return jsonify({"error": "Invalid FEN"}), 400
-        stockfish.set_fen_position(fen)
-        return jsonify({"top_moves": stockfish.get_top_moves(n)})
+        kind = f"top_moves/{n}/{skill_level}"
+        result = analysis_cache.get_or_compute(kind, fen, depth, search)
+        return fastjson(result, etag=etag)
     except Exception as e:
-        return jsonify({"error": str(e)}), 500
+        return fastjson({"error": str(e)}, 500)
 
 
 @app.route("/set_skill", methods=["POST", "OPTIONS"])  # Add OPTIONS
 def set_skill_level():
-    if not stockfish:
-        return jsonify({"error": "Stockfish engine not initialized"}), 500
-    data = request.get_json()
-    level = data.get("level")
-    if level is None:
-        return jsonify({"error": "Skill level not provided"}), 400
+    if not engines:
+        return fastjson({"error": "Stockfish engine not initialized"}, 500)
+    level = decode_request(SkillRequest).level
+    # Every worker's pooled engines pick this up on their next checkout
+    shared_state.set("skill_level", level)
+    return fastjson({"message": f"Skill level set to {level}"})
+
+
+# Streams iterative deepening: the client sends {"fen": ..., "depth": N} and
+# receives {"depth", "evaluation", "pv"} per completed depth, then
+# {"bestmove", "evaluation", "pv", "done": true}, after which the socket closes
+@sock.route("/ws/analyze")
+def analyze_stream(ws):
+    if not engines:
+        ws.send(orjson.dumps({"error": "Stockfish engine not initialized"}).decode())
+        return
     try:
-        level = int(level)
-        if not 0 <= level <= 20:
-            return jsonify({"error": "Skill level must be between 0 and 20"}), 400
-        stockfish.set_skill_level(level)
-        return jsonify({"message": f"Skill level set to {level}"})
-    except ValueError:
-        return jsonify({"error": "Invalid skill level format"}), 400
-    except Exception as e:
-        return jsonify({"error": str(e)}), 500
+        req = msgspec.json.decode(ws.receive(), type=AnalyzeRequest)
+    except msgspec.DecodeError as e:
+        ws.send(orjson.dumps({"error": f"Invalid request: {e}"}).decode())
+        return
+    fen = req.fen
+    if not quick_fen_ok(fen):
+        ws.send(orjson.dumps({"error": "Invalid FEN"}).decode())
+        return
+    depth = resolve_depth(req.depth)
+    kind = f"analysis/{current_skill_level()}"
+
+    # If the client disconnects mid-search, closing the generator stops the
+    # search before the engine goes back to the pool
+    with checkout_engine() as engine, closing(
+        search_updates(engine, fen, depth)
+    ) as updates:
+        for update in updates:
+            if "bestmove" in update:
+                analysis_cache.put(kind, fen, depth, update)
+                update = {**update, "done": True}
+            ws.send(orjson.dumps(update).decode())
+
+
+# Call when switching to an unrelated game so stale hash entries are dropped
+@app.route("/new_game", methods=["POST", "OPTIONS"])
+def new_game():
+    if not engines:
+        return fastjson({"error": "Stockfish engine not initialized"}, 500)
+    # Every worker's pooled engines clear their hash on their next checkout
+    shared_state.increment("game_generation")
+    return fastjson({"message": "Engine hash will be cleared before the next search"})
+
+
+# Counters are per worker process (identified by worker_pid), not server-wide
+@app.route("/cache_stats", methods=["GET"])
+def cache_stats():
+    return fastjson({"worker_pid": os.getpid(), **analysis_cache.stats()})
 
 
 if __name__ == "__main__":
+    # Development server only; production runs under gunicorn (gunicorn_conf.py)
     # Ensure the app runs on host 0.0.0.0 and port 5000
-    app.run(host="0.0.0.0", port=5000)
+    # threaded=True lets concurrent requests use different pooled engines
+    app.run(host="0.0.0.0", port=5000, threaded=True)
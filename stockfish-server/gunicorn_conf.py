@@ -0,0 +1,38 @@
+# Gunicorn settings for the Stockfish server
+# Usage: gunicorn -c gunicorn_conf.py -b 0.0.0.0:5000 app:app
+import os
+import tempfile
+
+# One worker process per pair of cores; each worker owns its own engine pool
+workers = int(os.environ.get("GUNICORN_WORKERS", max(1, (os.cpu_count() or 2) // 2)))
+
+# Threaded workers keep accepting requests while an engine is searching;
+# cache hits are answered immediately and other requests wait for a free engine
+worker_class = "gthread"
+threads = int(os.environ.get("GUNICORN_THREADS", 4))
+
+# Deep searches and batches can take a while; don't kill workers mid-analysis
+timeout = 60
+
+# Load the app in each worker rather than in the master, so every worker
+# starts its own Stockfish processes instead of sharing inherited pipes
+preload_app = False
+
+# Searches are CPU-bound, so a worker needs fewer engines than request threads
+# (enough for /analyze_batch to fan out) rather than one engine per core
+os.environ.setdefault("STOCKFISH_POOL_SIZE", "2")
+
+# /set_skill and /new_game must reach every worker, so process-wide settings live in a SQLite
+# file unique to this gunicorn master (see SharedState in app.py)
+if "SERVER_STATE_PATH" not in os.environ:
+    _state_path = os.path.join(
+        tempfile.gettempdir(), f"stockfish-server-{os.getpid()}.sqlite3"
+    )
+    os.environ["SERVER_STATE_PATH"] = _state_path
+
+    def on_exit(server):
+        for suffix in ("", "-wal", "-shm"):
+            try:
+                os.remove(_state_path + suffix)
+            except FileNotFoundError:
+                pass
@@ -0,0 +1,87 @@
+"""Minimal UCI client that talks to Stockfish directly over its stdin/stdout pipes."""
+
+import subprocess
+
+
+class EngineError(Exception):
+    """Raised when the engine process has exited or stopped accepting input."""
+
+
+class UCIEngine:
+    """A Stockfish process driven with the raw UCI line protocol.
+
+    Only the commands the server needs are wrapped; after ``put("go ...")``
+    the caller reads the search output itself with read_line().
+    """
+
+    def __init__(self, path, options=None):
+        self._process = subprocess.Popen(
+            [path],
+            stdin=subprocess.PIPE,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.DEVNULL,
+            bufsize=1,
+            text=True,
+        )
+        self.name = None  # e.g. "Stockfish 17.1", reported by the engine
+        self.options = {}  # Options set through set_option()
+
+        self.put("uci")
+        while True:
+            line = self.read_line()
+            if line.startswith("id name "):
+                self.name = line[len("id name ") :]
+            elif line == "uciok":
+                break
+        for name, value in (options or {}).items():
+            self.set_option(name, value)
+        self.is_ready()
+
+    def put(self, command):
+        try:
+            self._process.stdin.write(f"{command}\n")
+            self._process.stdin.flush()
+        except OSError as e:  # Includes BrokenPipeError
+            raise EngineError(f"Stockfish process is not accepting input: {e}") from e
+
+    def read_line(self):
+        line = self._process.stdout.readline()
+        if not line:
+            raise EngineError("Stockfish process exited unexpectedly")
+        return line.strip()
+
+    def is_ready(self):
+        """Block until the engine has processed every command sent so far."""
+        self.put("isready")
+        while self.read_line() != "readyok":
+            pass
+
+    def set_option(self, name, value):
+        self.put(f"setoption name {name} value {value}")
+        self.options[name] = value
+
+    def restore_options(self, options):
+        """Set back any option whose value differs from ``options``."""
+        for name, value in options.items():
+            if self.options.get(name) != value:
+                self.set_option(name, value)
+
+    def new_game(self):
+        """Send ucinewgame, which clears the engine's hash."""
+        self.put("ucinewgame")
+        self.is_ready()
+
+    def set_position(self, fen, moves=()):
+        command = f"position fen {fen}"
+        if moves:
+            command += f" moves {' '.join(moves)}"
+        self.put(command)
+
+    def close(self):
+        if self._process.poll() is not None:
+            return
+        try:
+            self.put("quit")
+            self._process.wait(timeout=1)
+        except (EngineError, subprocess.TimeoutExpired):
+            self._process.kill()